@@ -1,9 +1,11 @@
 """TCP client for communicating with the Equilibria controller."""
 
 import asyncio
-import json
 import logging
-from typing import Optional, Callable, Dict, Any
+from collections import deque
+from typing import Optional, Callable, Dict, Any, List, Deque
+
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +27,26 @@ MODE_IDLE = "IDLE"
 MODE_ACTIVE = "ACTIVE"
 
 
+def _encode_message(msg_type: str, payload: Dict[str, Any]) -> bytes:
+    """Encode a message as a newline-terminated JSON frame."""
+    message = {
+        "version": PROTOCOL_VERSION,
+        "type": msg_type,
+        "payload": payload
+    }
+    return orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE)
+
+
 class ControllerClient:
     """Async TCP client for the Equilibria controller IPC protocol v0."""
     
+    # Frames for commands whose payload never varies are encoded once
+    _GET_TELEMETRY_FRAME = _encode_message(MSG_GET_TELEMETRY, {})
+    _SET_MODE_FRAMES = {
+        mode: _encode_message(MSG_SET_MODE, {"mode": mode})
+        for mode in (MODE_IDLE, MODE_ACTIVE)
+    }
+    
     def __init__(
         self,
         host: str = DEFAULT_HOST,
@@ -41,6 +60,9 @@ class ControllerClient:
         self._reader: Optional[asyncio.StreamReader] = None
         self._writer: Optional[asyncio.StreamWriter] = None
         self._running = False
+        self._pending_frames: List[bytes] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._ack_waiters: Dict[str, Deque[Optional[asyncio.Future]]] = {}
         self._telemetry_callback: Optional[Callable[[Dict[str, Any]], None]] = None
         self._ack_callback: Optional[Callable[[Dict[str, Any]], None]] = None
         
@@ -75,35 +97,78 @@ class ControllerClient:
             finally:
                 self._writer = None
                 self._reader = None
+                self._pending_frames = []
+                self._fail_ack_waiters()
+                
+    def _fail_ack_waiters(self):
+        """Fail all commands still waiting for an ACK."""
+        for waiters in self._ack_waiters.values():
+            for future in waiters:
+                if future is not None and not future.done():
+                    future.set_exception(
+                        ConnectionError("Controller connection lost")
+                    )
+        self._ack_waiters.clear()
                 
     async def _send_message(self, msg_type: str, payload: Dict[str, Any]):
         """Send a message to the controller."""
+        await self._send_frame(msg_type, _encode_message(msg_type, payload))
+        
+    async def _send_frame(
+        self,
+        msg_type: str,
+        frame: bytes,
+        ack_future: Optional[asyncio.Future] = None
+    ):
+        """Send an encoded message frame to the controller."""
         if not self._writer:
             logger.error("[API] Not connected to controller")
             return
             
-        message = {
-            "version": PROTOCOL_VERSION,
-            "type": msg_type,
-            "payload": payload
-        }
-        
+        # The controller acknowledges every command except get_telemetry, so
+        # each acknowledged frame takes a slot to keep ACKs aligned; frames
+        # sent without waiting for their ACK take an empty one
+        if msg_type != MSG_GET_TELEMETRY:
+            self._ack_waiters.setdefault(msg_type, deque()).append(ack_future)
+            
+        # Frames queued in the same loop iteration are written together and
+        # share a single drain()
+        self._pending_frames.append(frame)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+            
         try:
-            json_str = json.dumps(message) + "\n"
-            self._writer.write(json_str.encode('utf-8'))
-            await self._writer.drain()
-            logger.debug(f"[API] Sent {msg_type} message")
+            await asyncio.shield(self._flush_task)
+            logger.debug("[API] Sent %s message", msg_type)
         except Exception as e:
             logger.error(f"[API] Failed to send message: {e}")
             await self.disconnect()
             
+    async def _flush(self):
+        """Write all queued frames to the controller."""
+        try:
+            while self._pending_frames:
+                if not self._writer:
+                    raise ConnectionError("Not connected to controller")
+                    
+                frames = self._pending_frames
+                self._pending_frames = []
+                self._writer.writelines(frames)
+                await self._writer.drain()
+        finally:
+            self._flush_task = None
+            
     async def get_telemetry(self):
         """Request telemetry from the controller."""
-        await self._send_message(MSG_GET_TELEMETRY, {})
+        await self._send_frame(MSG_GET_TELEMETRY, self._GET_TELEMETRY_FRAME)
         
     async def set_mode(self, mode: str):
         """Set the controller operating mode."""
-        await self._send_message(MSG_SET_MODE, {"mode": mode})
+        frame = self._SET_MODE_FRAMES.get(mode)
+        if frame is None:
+            frame = _encode_message(MSG_SET_MODE, {"mode": mode})
+            
+        await self._send_frame(MSG_SET_MODE, frame)
         
     async def set_targets(
         self,
@@ -119,23 +184,77 @@ class ControllerClient:
             
         await self._send_message(MSG_SET_TARGETS, payload)
         
-    async def _handle_message(self, message: Dict[str, Any]):
-        """Handle an incoming message from the controller."""
+    async def send_command(
+        self,
+        msg_type: str,
+        payload: Dict[str, Any],
+        timeout: float = 5.0
+    ) -> Dict[str, Any]:
+        """Send a command and return the payload of its ACK.
+        
+        The controller acknowledges commands in the order it receives them,
+        so each ACK resolves the oldest outstanding command of the same type,
+        whether it was sent here or by set_mode()/set_targets(). Any number
+        of commands may be in flight on the connection at once.
+        
+        get_telemetry is answered with telemetry rather than an ACK and is
+        rejected; use get_telemetry() instead.
+        """
+        if msg_type == MSG_GET_TELEMETRY:
+            raise ValueError(f"{msg_type} is not acknowledged by the controller")
+        if not self._writer:
+            raise ConnectionError("Not connected to controller")
+            
+        future = asyncio.get_running_loop().create_future()
+        await self._send_frame(
+            msg_type, _encode_message(msg_type, payload), future
+        )
+        
+        return await asyncio.wait_for(future, timeout)
+        
+    async def _handle_message(self, line: bytes):
+        """Handle an incoming message line from the controller."""
+        try:
+            message = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            logger.error(f"[API] Failed to parse JSON: {e}")
+            return
+            
         try:
+            version = message.get("version")
+            if version != PROTOCOL_VERSION:
+                logger.warning("[API] Unsupported protocol version: %s", version)
+                return
+                
+            # payload is required by the protocol, so no default is built
             msg_type = message.get("type")
-            payload = message.get("payload", {})
+            payload = message.get("payload")
+            if payload is None:
+                logger.warning("[API] Missing payload in %s message", msg_type)
+                return
             
             if msg_type == MSG_TELEMETRY:
                 if self._telemetry_callback:
                     self._telemetry_callback(payload)
                     
             elif msg_type == MSG_ACK:
+                waiters = self._ack_waiters.get(payload.get("command"))
+                if waiters:
+                    # Timed-out commands stay queued so a late ACK is
+                    # consumed by them rather than by a newer command
+                    future = waiters.popleft()
+                    if future is not None and not future.done():
+                        future.set_result(payload)
+                        
                 if self._ack_callback:
                     self._ack_callback(payload)
-                logger.info(
-                    f"[API] ACK for {payload.get('command')}: "
-                    f"{payload.get('status')} - {payload.get('message', '')}"
-                )
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(
+                        "[API] ACK for %s: %s - %s",
+                        payload.get("command"),
+                        payload.get("status"),
+                        payload.get("message", "")
+                    )
                 
             else:
                 logger.warning(f"[API] Unknown message type: {msg_type}")
@@ -145,30 +264,23 @@ class ControllerClient:
             
     async def _receive_loop(self):
         """Main receive loop for processing incoming messages."""
-        incomplete_data = ""
-        
         while self._running and self._reader:
             try:
-                data = await self._reader.read(4096)
+                # StreamReader frames newline-delimited messages in its own
+                # buffer, so partial lines are never re-copied or re-scanned
+                line = await self._reader.readline()
                 
-                if not data:
+                if not line:
                     # Connection closed
                     logger.warning("[API] Controller connection closed")
                     break
                     
-                incomplete_data += data.decode('utf-8')
-                
-                # Process complete messages (newline-delimited)
-                while '\n' in incomplete_data:
-                    line, incomplete_data = incomplete_data.split('\n', 1)
+                # orjson accepts the trailing newline, so lines are passed on
+                # as raw bytes without decoding or stripping. isspace() stops
+                # at the first non-blank byte and skips blank keep-alive lines
+                if not line.isspace():
+                    await self._handle_message(line)
                     
-                    if line.strip():
-                        try:
-                            message = json.loads(line)
-                            await self._handle_message(message)
-                        except json.JSONDecodeError as e:
-                            logger.error(f"[API] Failed to parse JSON: {e}")
-                            
             except Exception as e:
                 logger.error(f"[API] Error in receive loop: {e}")
                 break
@@ -5,6 +5,11 @@ import logging
 from typing import Dict, Any
 from .controller_client import ControllerClient
 
+try:
+    import uvloop
+except ImportError:  # Optional; not available on Windows
+    uvloop = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -27,17 +32,23 @@ class APIServer:
     def _on_telemetry(self, payload: Dict[str, Any]):
         """Handle telemetry updates from controller."""
         self.latest_telemetry = payload
-        logger.info(
-            f"[API] Telemetry: mode={payload.get('mode')}, "
-            f"timestamp={payload.get('timestamp_ms')}"
-        )
+        # Called at the telemetry rate; skip building the record when unused
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "[API] Telemetry: mode=%s, timestamp=%s",
+                payload.get("mode"),
+                payload.get("timestamp_ms")
+            )
         
     def _on_ack(self, payload: Dict[str, Any]):
         """Handle ACK responses from controller."""
-        logger.info(
-            f"[API] ACK received: {payload.get('command')} -> "
-            f"{payload.get('status')}: {payload.get('message', '')}"
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "[API] ACK received: %s -> %s: %s",
+                payload.get("command"),
+                payload.get("status"),
+                payload.get("message", "")
+            )
         
     async def run(self):
         """Run the API server."""
@@ -75,6 +86,9 @@ class APIServer:
 
 def main():
     """Main entry point."""
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        
     server = APIServer()
     
     try:
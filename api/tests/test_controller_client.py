@@ -1,134 +1,351 @@
 """Tests for the controller client."""
 
+import asyncio
+import contextlib
+import functools
 import json
+import orjson
 import pytest
 
+from equilibria_api.controller_client import ControllerClient, _encode_message
 
-def test_message_structure():
-    """Test that message structure is correct."""
-    message = {
-        "version": "v0",
-        "type": "get_telemetry",
-        "payload": {}
+
+# Sample protocol messages (see docs/protocol.md)
+_GET_TELEMETRY_MSG = {
+    "version": "v0",
+    "type": "get_telemetry",
+    "payload": {}
+}
+
+_SET_MODE_MSG = {
+    "version": "v0",
+    "type": "set_mode",
+    "payload": {
+        "mode": "ACTIVE"
+    }
+}
+
+_SET_TARGETS_MSG = {
+    "version": "v0",
+    "type": "set_targets",
+    "payload": {
+        "target_abv": 95.0,
+        "target_flow": 300.0
+    }
+}
+
+_TELEMETRY_MSG = {
+    "version": "v0",
+    "type": "telemetry",
+    "payload": {
+        "timestamp_ms": 1234567890,
+        "mode": "IDLE",
+        "temps": {
+            "vapour_head": 78.2,
+            "boiler_liquid": 91.5,
+            "pcb_environment": 42.1
+        },
+        "pressures": {
+            "ambient": 101.3,
+            "vapour": None
+        },
+        "flow_ml_min": 240.0,
+        "valves": {
+            "reflux_control": 65,
+            "product_takeoff": 30
+        },
+        "heaters": {
+            "heater_1": 70,
+            "heater_2": 70
+        },
+        "faults": []
+    }
+}
+
+_ACK_MSG = {
+    "version": "v0",
+    "type": "ack",
+    "payload": {
+        "command": "set_mode",
+        "status": "ok",
+        "message": "Mode set successfully"
     }
+}
+
+
+_OUTBOUND_MSGS = [_GET_TELEMETRY_MSG, _SET_MODE_MSG, _SET_TARGETS_MSG]
+_INBOUND_MSGS = [_TELEMETRY_MSG, _ACK_MSG]
+
+# Reference wire frames for outbound commands, encoded once at import
+_EXPECTED_FRAMES = {
+    message["type"]: orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE)
+    for message in _OUTBOUND_MSGS
+}
+
+
+def _message_id(message):
+    return message["type"]
+
+
+@pytest.mark.parametrize("message", _OUTBOUND_MSGS, ids=_message_id)
+def test_outbound_frame(message):
+    """Test that commands are encoded as documented."""
+    frame = _encode_message(message["type"], message["payload"])
     
-    json_str = json.dumps(message)
-    parsed = json.loads(json_str)
+    assert frame == _EXPECTED_FRAMES[message["type"]]
+
+
+def test_precomputed_frames():
+    """Test that pre-encoded command frames match the reference frames."""
+    assert ControllerClient._GET_TELEMETRY_FRAME == _EXPECTED_FRAMES["get_telemetry"]
+    assert ControllerClient._SET_MODE_FRAMES["ACTIVE"] == _EXPECTED_FRAMES["set_mode"]
+    assert ControllerClient._SET_MODE_FRAMES["IDLE"] == _encode_message(
+        "set_mode", {"mode": "IDLE"}
+    )
+
+
+@pytest.mark.parametrize(
+    "message", _OUTBOUND_MSGS + _INBOUND_MSGS, ids=_message_id
+)
+def test_wire_roundtrip(message):
+    """Test that messages parse back to the original structure."""
+    assert orjson.loads(orjson.dumps(message)) == message
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("message", _INBOUND_MSGS, ids=_message_id)
+async def test_inbound_dispatch(message):
+    """Test that inbound messages reach their callback with the payload."""
+    received = []
+    client = ControllerClient()
+    client.set_telemetry_callback(received.append)
+    client.set_ack_callback(received.append)
     
+    await client._handle_message(
+        orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE)
+    )
+    
+    assert received == [message["payload"]]
+
+
+def test_newline_delimiter():
+    """Test that messages use newline delimiters."""
+    frame = _encode_message("get_telemetry", {})
+    
+    assert frame.endswith(b"\n")
+    assert frame.count(b"\n") == 1
+    
+    # Should be parseable with the trailing newline in place
+    parsed = orjson.loads(frame)
     assert parsed["version"] == "v0"
-    assert parsed["type"] == "get_telemetry"
-    assert parsed["payload"] == {}
 
 
-def test_set_mode_message():
-    """Test set_mode message structure."""
-    message = {
-        "version": "v0",
-        "type": "set_mode",
-        "payload": {
-            "mode": "ACTIVE"
-        }
-    }
+@pytest.mark.benchmark(group="command-encode")
+def test_bench_command_encode(benchmark):
+    """Benchmark encoding a command frame."""
+    frame = benchmark(
+        _encode_message, "set_targets", _SET_TARGETS_MSG["payload"]
+    )
     
-    json_str = json.dumps(message)
-    parsed = json.loads(json_str)
+    assert frame == _EXPECTED_FRAMES["set_targets"]
+
+
+def _handle_sync(client, line):
+    """Run _handle_message to completion without an event loop.
     
-    assert parsed["payload"]["mode"] == "ACTIVE"
+    _handle_message never suspends, so this measures the client's decode
+    and dispatch path without event-loop scheduling overhead.
+    """
+    coro = client._handle_message(line)
+    try:
+        coro.send(None)
+    except StopIteration:
+        return
+    coro.close()
+    raise AssertionError("_handle_message suspended unexpectedly")
 
 
-def test_set_targets_message():
-    """Test set_targets message structure."""
-    message = {
-        "version": "v0",
-        "type": "set_targets",
-        "payload": {
-            "target_abv": 95.0,
-            "target_flow": 300.0
-        }
-    }
+@pytest.mark.benchmark(group="telemetry-decode")
+def test_bench_telemetry_decode(benchmark):
+    """Benchmark handling an inbound telemetry frame."""
+    latest = {}
+    client = ControllerClient()
+    client.set_telemetry_callback(latest.update)
+    frame = orjson.dumps(_TELEMETRY_MSG, option=orjson.OPT_APPEND_NEWLINE)
     
-    json_str = json.dumps(message)
-    parsed = json.loads(json_str)
-    
-    assert parsed["payload"]["target_abv"] == 95.0
-    assert parsed["payload"]["target_flow"] == 300.0
-
-
-def test_telemetry_structure():
-    """Test telemetry message structure."""
-    telemetry = {
-        "version": "v0",
-        "type": "telemetry",
-        "payload": {
-            "timestamp_ms": 1234567890,
-            "mode": "IDLE",
-            "temps": {
-                "vapour_head": 78.2,
-                "boiler_liquid": 91.5,
-                "pcb_environment": 42.1
-            },
-            "pressures": {
-                "ambient": 101.3,
-                "vapour": None
-            },
-            "flow_ml_min": 240.0,
-            "valves": {
-                "reflux_control": 65,
-                "product_takeoff": 30
-            },
-            "heaters": {
-                "heater_1": 70,
-                "heater_2": 70
-            },
-            "faults": []
-        }
-    }
+    benchmark(_handle_sync, client, frame)
     
-    json_str = json.dumps(telemetry)
-    parsed = json.loads(json_str)
-    
-    assert parsed["payload"]["mode"] == "IDLE"
-    assert parsed["payload"]["temps"]["vapour_head"] == 78.2
-    assert parsed["payload"]["pressures"]["vapour"] is None
-    assert parsed["payload"]["valves"]["reflux_control"] == 65
-    assert parsed["payload"]["faults"] == []
-
-
-def test_ack_structure():
-    """Test ACK message structure."""
-    ack = {
-        "version": "v0",
-        "type": "ack",
-        "payload": {
-            "command": "set_mode",
-            "status": "ok",
-            "message": "Mode set successfully"
+    assert latest == _TELEMETRY_MSG["payload"]
+
+
+async def _fake_controller(reader, writer, first_ack_delay=0.0):
+    """ACK every command but get_telemetry in order, echoing its payload."""
+    delay = first_ack_delay
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        message = json.loads(line)
+        if message["type"] == "get_telemetry":
+            continue
+        if delay:
+            await asyncio.sleep(delay)
+            delay = 0.0
+        ack = {
+            "version": "v0",
+            "type": "ack",
+            "payload": {
+                "command": message["type"],
+                "status": "ok",
+                "message": json.dumps(message["payload"])
+            }
         }
-    }
+        writer.write(json.dumps(ack).encode("utf-8") + b"\n")
+        await writer.drain()
+        
+    writer.close()
+    await writer.wait_closed()
+
+
+@contextlib.asynccontextmanager
+async def _connected_client(first_ack_delay=0.0):
+    """Yield a client connected to a fake controller."""
+    server = await asyncio.start_server(
+        functools.partial(_fake_controller, first_ack_delay=first_ack_delay),
+        "127.0.0.1",
+        0
+    )
+    port = server.sockets[0].getsockname()[1]
+    client = ControllerClient(port=port)
+    run_task = asyncio.create_task(client.run())
     
-    json_str = json.dumps(ack)
-    parsed = json.loads(json_str)
+    async def wait_connected():
+        while not client._writer:
+            await asyncio.sleep(0.01)
+            
+    try:
+        await asyncio.wait_for(wait_connected(), timeout=2.0)
+        yield client
+    finally:
+        await client.stop()
+        run_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await run_task
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_send_command_returns_matching_ack():
+    """Test that pipelined commands each receive their own ACK."""
+    async with _connected_client() as client:
+        acks = await asyncio.gather(
+            client.send_command("set_mode", {"mode": "ACTIVE"}),
+            client.send_command("set_targets", {"target_abv": 95.0}),
+            client.send_command("set_mode", {"mode": "IDLE"}),
+        )
+        
+    assert [ack["command"] for ack in acks] == [
+        "set_mode", "set_targets", "set_mode"
+    ]
+    assert json.loads(acks[0]["message"]) == {"mode": "ACTIVE"}
+    assert json.loads(acks[2]["message"]) == {"mode": "IDLE"}
+
+
+@pytest.mark.asyncio
+async def test_send_command_after_fire_and_forget():
+    """Test that ACKs for set_mode()/set_targets() are not misattributed."""
+    async with _connected_client() as client:
+        await client.set_mode("ACTIVE")
+        await client.set_targets(target_abv=95.0)
+        acks = await asyncio.gather(
+            client.send_command("set_mode", {"mode": "IDLE"}),
+            client.send_command("set_targets", {"target_flow": 300.0}),
+        )
+        
+    assert json.loads(acks[0]["message"]) == {"mode": "IDLE"}
+    assert json.loads(acks[1]["message"]) == {"target_flow": 300.0}
+
+
+@pytest.mark.asyncio
+async def test_send_command_rejects_get_telemetry():
+    """Test that commands answered without an ACK are rejected."""
+    async with _connected_client() as client:
+        with pytest.raises(ValueError):
+            await client.send_command("get_telemetry", {})
+            
+        assert not client._ack_waiters.get("get_telemetry")
+
+
+@pytest.mark.asyncio
+async def test_late_ack_is_not_misattributed():
+    """Test that a late ACK for a timed-out command is not reused."""
+    async with _connected_client(first_ack_delay=0.2) as client:
+        with pytest.raises(asyncio.TimeoutError):
+            await client.send_command("set_mode", {"mode": "ACTIVE"}, timeout=0.05)
+            
+        ack = await client.send_command("set_mode", {"mode": "IDLE"})
+        
+    assert json.loads(ack["message"]) == {"mode": "IDLE"}
+
+
+@pytest.mark.asyncio
+async def test_blank_lines_are_skipped(caplog):
+    """Test that blank keep-alive lines are ignored without errors."""
+    received = []
+    
+    async def controller(reader, writer):
+        writer.write(b"\n\r\n \n")
+        writer.write(orjson.dumps(_TELEMETRY_MSG, option=orjson.OPT_APPEND_NEWLINE))
+        await writer.drain()
+        writer.close()
+        
+    server = await asyncio.start_server(controller, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    client = ControllerClient(port=port)
+    client.set_telemetry_callback(received.append)
     
-    assert parsed["payload"]["command"] == "set_mode"
-    assert parsed["payload"]["status"] == "ok"
-    assert parsed["payload"]["message"] == "Mode set successfully"
+    try:
+        assert await client.connect()
+        client._running = True
+        await asyncio.wait_for(client._receive_loop(), timeout=2.0)
+    finally:
+        await client.stop()
+        server.close()
+        await server.wait_closed()
+        
+    assert received == [_TELEMETRY_MSG["payload"]]
+    assert not [r for r in caplog.records if r.levelname == "ERROR"]
 
 
-def test_newline_delimiter():
-    """Test that messages use newline delimiters."""
-    message = {
-        "version": "v0",
-        "type": "get_telemetry",
-        "payload": {}
-    }
+@pytest.mark.asyncio
+async def test_unsupported_version_is_ignored():
+    """Test that messages with an unknown version are not dispatched."""
+    received = []
+    client = ControllerClient()
+    client.set_telemetry_callback(received.append)
     
-    json_str = json.dumps(message) + "\n"
+    await client._handle_message(
+        b'{"version": "v1", "type": "telemetry", "payload": {"mode": "IDLE"}}\n'
+    )
+    await client._handle_message(
+        b'{"version": "v0", "type": "telemetry", "payload": {"mode": "ACTIVE"}}\n'
+    )
     
-    assert json_str.endswith("\n")
+    assert received == [{"mode": "ACTIVE"}]
+
+
+@pytest.mark.asyncio
+async def test_missing_payload_is_ignored(caplog):
+    """Test that messages without a payload are reported and not dispatched."""
+    received = []
+    client = ControllerClient()
+    client.set_telemetry_callback(received.append)
     
-    # Should be parseable without newline
-    parsed = json.loads(json_str.strip())
-    assert parsed["version"] == "v0"
+    await client._handle_message(b'{"version": "v0", "type": "telemetry"}\n')
+    
+    assert received == []
+    assert "Missing payload in telemetry message" in caplog.text
 
 
 if __name__ == "__main__":